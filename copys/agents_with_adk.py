@@ -1,19 +1,43 @@
 import asyncio
-import json
-from typing import AsyncGenerator, List, Dict, Any
-from google.adk.agents import LlmAgent, SequentialAgent, BaseAgent
+import hashlib
+import re
+import time
+from collections import OrderedDict
+import orjson
+from cachetools import TTLCache
+from typing import AsyncGenerator, List, Dict, Any, Optional, Tuple
+from google.adk.agents import LlmAgent, BaseAgent
 from google.adk.tools import FunctionTool, ToolContext
 from google.adk.events import Event, EventActions
 from google.adk.agents.invocation_context import InvocationContext
+from google.genai import types
 from src.utils.google_search import google_search, google_lens_search
-from src.utils.scrap_website import scrap_website
+from src.utils.scrap_website import scrap_website, get_crawler
 from sqlalchemy.orm import Session
-from src.database import SessionLocal
+from sqlalchemy import select
+from src.database import AsyncSessionLocal
 from src.models.clothing import ClothingItem
 from src.models.user import User
 from src.utils.auth import get_current_user
 
 
+def _dumps(obj: Any) -> str:
+    """Serializes to a JSON string with orjson (tools must return `str`, not bytes)."""
+    return orjson.dumps(obj).decode()
+
+
+# Response caches for tools whose results are stable across requests.
+# Keyed by SHA-256 of the canonicalized input; bounded LRU with a TTL.
+_search_cache: TTLCache = TTLCache(maxsize=10_000, ttl=60 * 60)
+_extract_cache: TTLCache = TTLCache(maxsize=10_000, ttl=24 * 60 * 60)
+
+
+def _cache_key(fn: str, **inputs: Any) -> str:
+    """Builds a stable cache key from the tool name and its inputs."""
+    payload = orjson.dumps({"fn": fn, **inputs}, option=orjson.OPT_SORT_KEYS)
+    return hashlib.sha256(payload).hexdigest()
+
+
 # Function tools for the search agent
 async def search_web(query: str) -> str:
     """
@@ -25,24 +49,30 @@ async def search_web(query: str) -> str:
     Returns:
         JSON string containing search results with links
     """
+    key = _cache_key("search_web", q=query)
+    cached = _search_cache.get(key)
+    if cached is not None:
+        return cached
+
     try:
         result = await google_search(query)
-        data = json.loads(result)
+        data = orjson.loads(result)
         
         # Extract links from search results
-        links = []
-        if 'organic' in data:
-            for item in data['organic']:
-                if 'link' in item:
-                    links.append({
-                        'title': item.get('title', ''),
-                        'link': item['link'],
-                        'snippet': item.get('snippet', '')
-                    })
+        get = dict.get
+        links = [
+            {'title': get(item, 'title', ''), 'link': item['link'], 'snippet': get(item, 'snippet', '')}
+            for item in data.get('organic', ())
+            if 'link' in item
+        ]
         
-        return json.dumps({'status': 'success', 'links': links, 'query': query})
+        response = _dumps({'status': 'success', 'links': links, 'query': query})
+        # Error bodies (quota, auth) carry no results; only cache real hits
+        if links:
+            _search_cache[key] = response
+        return response
     except Exception as e:
-        return json.dumps({'status': 'error', 'message': str(e)})
+        return _dumps({'status': 'error', 'message': str(e)})
 
 
 async def search_by_image(image_url: str) -> str:
@@ -55,73 +85,374 @@ async def search_by_image(image_url: str) -> str:
     Returns:
         JSON string containing search results with links
     """
+    key = _cache_key("search_by_image", image_url=image_url)
+    cached = _search_cache.get(key)
+    if cached is not None:
+        return cached
+
     try:
         result = await google_lens_search(image_url)
-        data = json.loads(result)
+        data = orjson.loads(result)
         
         # Extract links from lens search results
-        links = []
-        if 'visual_matches' in data:
-            for item in data['visual_matches']:
-                if 'link' in item:
-                    links.append({
-                        'title': item.get('title', ''),
-                        'link': item['link'],
-                        'snippet': item.get('snippet', '')
-                    })
+        get = dict.get
+        links = [
+            {'title': get(item, 'title', ''), 'link': item['link'], 'snippet': get(item, 'snippet', '')}
+            for item in data.get('visual_matches', ())
+            if 'link' in item
+        ]
         
-        return json.dumps({'status': 'success', 'links': links, 'image_url': image_url})
+        response = _dumps({'status': 'success', 'links': links, 'image_url': image_url})
+        # Error bodies (quota, auth) carry no results; only cache real hits
+        if links:
+            _search_cache[key] = response
+        return response
     except Exception as e:
-        return json.dumps({'status': 'error', 'message': str(e)})
+        return _dumps({'status': 'error', 'message': str(e)})
+
 
+# Limit to 5 links to avoid timeouts
+MAX_SCRAPE_LINKS = 5
+# Upper bound for a scraping step, so one stalled site can't hold up the chain
+SCRAPE_TIMEOUT_SECONDS = 10
 
-async def scrape_websites(links_json: str) -> str:
+
+def _failed_page(link_info: Dict[str, Any], error: str) -> Dict[str, Any]:
+    """Builds the scraped-page entry for a link that could not be scraped."""
+    return {
+        'url': link_info.get('link', ''),
+        'title': link_info.get('title', ''),
+        'content': '',
+        'status': 'failed',
+        'error': error
+    }
+
+
+async def _scrape_link(link_info: Dict[str, Any], crawler) -> Dict[str, Any]:
+    """Scrapes a single search result link into a scraped-page entry."""
+    url = link_info['link']
+    result = await scrap_website(url, crawler=crawler)
+    if result and hasattr(result, 'markdown'):
+        return {
+            'url': url,
+            'title': link_info.get('title', ''),
+            'content': result.markdown[:5000],  # Limit content size
+            'status': 'success'
+        }
+    return _failed_page(link_info, 'No markdown content returned')
+
+
+async def _scrape_stage(link_queue: asyncio.Queue, page_queue: asyncio.Queue) -> List[Dict[str, Any]]:
     """
-    Scrapes multiple websites and returns their markdown content.
-    
-    Args:
-        links_json: JSON string containing list of links to scrape
-        
+    Scrapes links from `link_queue` as they arrive, until a None sentinel.
+
+    Every scraped page is pushed onto `page_queue` as soon as it is ready, and a
+    None sentinel always follows, even if scraping fails. Scrapes run
+    concurrently on one shared browser; failures (including the browser not
+    starting) become failed pages instead of exceptions. Once the sentinel is
+    read, the scrapes still running get SCRAPE_TIMEOUT_SECONDS to finish; any
+    left after that are cancelled and get a 'timeout' failed page.
+
     Returns:
-        JSON string containing scraped content for each URL
+        The scraped pages, in the order the links arrived
     """
+    received: List[Dict[str, Any]] = []
+    tasks: List[asyncio.Task] = []
     try:
-        links_data = json.loads(links_json)
-        if 'links' not in links_data:
-            return json.dumps({'status': 'error', 'message': 'Invalid links format'})
-        
-        scraped_content = []
-        for link_info in links_data['links'][:5]:  # Limit to 5 links to avoid timeouts
-            try:
-                url = link_info['link']
-                result = await scrap_website(url)
-                if result and hasattr(result, 'markdown'):
-                    scraped_content.append({
-                        'url': url,
-                        'title': link_info.get('title', ''),
-                        'content': result.markdown[:5000],  # Limit content size
-                        'status': 'success'
-                    })
-                else:
-                    scraped_content.append({
-                        'url': url,
-                        'title': link_info.get('title', ''),
-                        'content': '',
-                        'status': 'failed',
-                        'error': 'No markdown content returned'
-                    })
-            except Exception as e:
-                scraped_content.append({
-                    'url': link_info['link'],
-                    'title': link_info.get('title', ''),
-                    'content': '',
-                    'status': 'failed',
-                    'error': str(e)
-                })
-        
-        return json.dumps({'status': 'success', 'scraped_data': scraped_content})
+        link_info = await link_queue.get()
+        if link_info is None:
+            return []
+
+        # All scrapes share one browser instead of launching one per URL
+        try:
+            crawler = await get_crawler()
+            crawler_error = None
+        except Exception as e:
+            crawler, crawler_error = None, f"Crawler unavailable: {e}"
+
+        async def _scrape(link_info: Dict[str, Any]) -> Dict[str, Any]:
+            if crawler_error is not None:
+                page = _failed_page(link_info, crawler_error)
+            else:
+                try:
+                    page = await _scrape_link(link_info, crawler)
+                except Exception as e:
+                    page = _failed_page(link_info, str(e))
+            await page_queue.put(page)
+            return page
+
+        loop = asyncio.get_running_loop()
+        try:
+            # No deadline while links are still coming in, so time spent by the
+            # search agent doesn't count against the scrapes
+            async with asyncio.timeout(None) as deadline:
+                # Scraping is I/O-bound, so fetch all sites concurrently instead of one by one;
+                # the task group cancels any scrapes still running on timeout or cancellation
+                async with asyncio.TaskGroup() as tg:
+                    while link_info is not None:
+                        received.append(link_info)
+                        tasks.append(tg.create_task(_scrape(link_info)))
+                        link_info = await link_queue.get()
+                    deadline.reschedule(loop.time() + SCRAPE_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+        pages = []
+        for link_info, task in zip(received, tasks):
+            if task.done() and not task.cancelled():
+                pages.append(task.result())
+            else:
+                page = _failed_page(link_info, 'timeout')
+                pages.append(page)
+                await page_queue.put(page)
+        return pages
+    finally:
+        await page_queue.put(None)
+
+
+def _first_json(text: str, opener: str = '{') -> str:
+    """
+    Returns the first balanced JSON object (or array, with opener='[') in `text`.
+
+    Scans once, tracking bracket depth and skipping brackets inside string
+    literals, so trailing prose or further JSON values after the first one
+    are ignored.
+    """
+    start = text.find(opener)
+    if start == -1:
+        raise ValueError("No JSON value found")
+
+    depth = 0
+    in_str = False
+    escape = False
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_str:
+            if escape:
+                escape = False
+            elif ch == '\\':
+                escape = True
+            elif ch == '"':
+                in_str = False
+        elif ch == '"':
+            in_str = True
+        elif ch in '{[':
+            depth += 1
+        elif ch in '}]':
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+    raise ValueError("Unbalanced JSON value")
+
+
+_model = None
+
+
+def _get_model():
+    """Returns the shared extraction model, creating it on first use."""
+    global _model
+    if _model is None:
+        # Lazy import of generative model to avoid heavy import at module load
+        # `GenerativeModel` lives in google-generativeai (google.genai has no such class)
+        import google.generativeai as generativeai
+
+        _model = generativeai.GenerativeModel("gemini-2.5-pro-preview-06-05")
+    return _model
+
+
+# Prompt cost scales with tokens, so each page is clipped by tokens, not chars
+EXTRACT_MARKDOWN_TOKEN_LIMIT = 800
+
+# Navigation/footer lines that carry no product information: table separators and
+# lines consisting only of a common menu entry (EN/RU), optionally as a list item,
+# a link and/or with a counter such as "Cart (2)". Menu words are anchored to the
+# whole line so product titles like "Home Jersey 2024" are kept.
+_BOILERPLATE_LINE = re.compile(
+    r"^\s*(?:"
+    r"[|:\s-]*"
+    r"|(?:[*+-]\s*)?\[?\s*"
+    r"(?:home|cart|login|log in|sign in|sign up|menu|account|wishlist|"
+    r"главная|корзина|войти|вход|регистрация|меню|каталог|избранное)"
+    r"\s*(?:\(\d+\))?\s*(?:\]\([^)]*\))?"
+    r")\s*$",
+    re.IGNORECASE | re.MULTILINE,
+)
+_BLANK_LINES = re.compile(r"\n{3,}")
+
+# Rough chars-per-token ratio, used to clip by characters when tiktoken is unavailable
+_CHARS_PER_TOKEN = 4
+
+
+def _load_encoding():
+    """
+    Loads the tiktoken encoding once at import time, so the BPE file (baked into
+    the image via TIKTOKEN_CACHE_DIR) is never fetched on the event loop.
+    Returns None if it can't be loaded; `_clip` then falls back to characters.
+    """
+    try:
+        import tiktoken
+
+        return tiktoken.get_encoding("cl100k_base")
     except Exception as e:
-        return json.dumps({'status': 'error', 'message': str(e)})
+        print(f"tiktoken encoding unavailable, clipping by characters: {e}")
+        return None
+
+
+_encoding = _load_encoding()
+
+
+def _clip(markdown: str, n: int = EXTRACT_MARKDOWN_TOKEN_LIMIT) -> str:
+    """Strips boilerplate lines from the markdown and truncates it to the first `n` tokens."""
+    markdown = _BLANK_LINES.sub("\n\n", _BOILERPLATE_LINE.sub("", markdown)).strip()
+    if _encoding is None:
+        return markdown[:n * _CHARS_PER_TOKEN]
+    ids = _encoding.encode(markdown)
+    if len(ids) <= n:
+        return markdown
+    return _encoding.decode(ids[:n])
+
+
+# Bound the number of in-flight extraction LLM calls to stay within rate limits
+_llm_semaphore = asyncio.Semaphore(8)
+
+
+async def _extract_single(markdown_snippet: str) -> Optional[Dict[str, Any]]:
+    """Extracts name/price/description for one page with a dedicated LLM call; None if that fails."""
+    prompt = (
+        "You are extracting structured e-commerce data from raw markdown of a product web page.\n"
+        "Return ONLY valid minified JSON with exactly these keys: \n"
+        "  name (string) – product/service name,\n"
+        "  price (string) – price with currency symbol if present, or \"Price not found\" if absent,\n"
+        "  description (string) – concise 1-2 sentence description (max 120 chars).\n"
+        "Do NOT wrap the JSON in markdown fences or add extra text.\n\n"
+        f"Markdown:\n{markdown_snippet}"
+    )
+
+    try:
+        async with _llm_semaphore:
+            gen_resp = await _get_model().generate_content_async(prompt)
+        # The model sometimes adds markdown fences or text – try to locate JSON substring
+        structured = orjson.loads(_first_json(gen_resp.text))
+    except Exception:
+        return None
+    return structured if isinstance(structured, dict) else None
+
+
+_BATCH_ROW_KEYS = {'id', 'name', 'price', 'description'}
+
+
+class ExtractionBatcher:
+    """
+    Coalesces extraction requests from all concurrent callers into row-marshaled prompts.
+
+    Pages submitted within `max_wait_ms` of each other (up to `max_batch` of them)
+    are sent to the model as one numbered JSON array, and the JSON array answer
+    is mapped back to each caller by id.
+    """
+
+    def __init__(self, max_batch: int = 8, max_wait_ms: float = 10):
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._flushes: set = set()
+
+    async def submit(self, markdown: str) -> Optional[Dict[str, Any]]:
+        """
+        Queues one page for batched extraction.
+
+        Returns:
+            The extracted fields (name, price, description), or None when the
+            batch answer could not be parsed or had no row for this page.
+        """
+        loop = asyncio.get_running_loop()
+        if self._worker is None or self._worker.done() or self._worker.get_loop() is not loop:
+            self._queue = asyncio.Queue()
+            self._worker = loop.create_task(self._run())
+
+        future = loop.create_future()
+        await self._queue.put((markdown, future))
+        return await future
+
+    async def aclose(self) -> None:
+        """Stops the worker and any in-flight batches (call on application shutdown)."""
+        loop = asyncio.get_running_loop()
+        tasks = [task for task in (self._worker, *self._flushes) if task is not None and task.get_loop() is loop]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._worker = None
+
+        # Release callers whose pages never left the queue
+        while self._queue is not None and not self._queue.empty():
+            _, future = self._queue.get_nowait()
+            future.cancel()
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch: List[Any] = []
+            try:
+                # Flush on whichever comes first: a full batch or the wait deadline
+                batch.append(await self._queue.get())
+                deadline = loop.time() + self.max_wait
+                while len(batch) < self.max_batch:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                    except asyncio.TimeoutError:
+                        break
+            except asyncio.CancelledError:
+                for _, future in batch:
+                    future.cancel()
+                raise
+
+            # Don't hold up collecting the next batch while the model answers
+            task = loop.create_task(self._flush(batch))
+            self._flushes.add(task)
+            task.add_done_callback(self._flushes.discard)
+
+    async def _flush(self, batch: List[Any]) -> None:
+        rows = [{'id': idx, 'markdown': markdown} for idx, (markdown, _) in enumerate(batch)]
+
+        prompt = (
+            "You are extracting structured e-commerce data from raw markdown of several product web pages.\n"
+            "The pages are given as a JSON array of objects with keys id and markdown.\n"
+            "Return ONLY a valid minified JSON array with one object per page and exactly these keys:\n"
+            "  id (integer) – the id of the page,\n"
+            "  name (string) – product/service name,\n"
+            "  price (string) – price with currency symbol if present, or \"Price not found\" if absent,\n"
+            "  description (string) – concise 1-2 sentence description (max 120 chars).\n"
+            "Do NOT wrap the JSON in markdown fences or add extra text.\n\n"
+            f"Pages:\n{_dumps(rows)}"
+        )
+
+        try:
+            async with _llm_semaphore:
+                gen_resp = await _get_model().generate_content_async(prompt)
+            parsed = orjson.loads(_first_json(gen_resp.text, '['))
+            # Rows missing a field resolve to None, so that page falls back to
+            # `_extract_single` and is not cached
+            by_id = {
+                int(row.pop('id')): row
+                for row in parsed
+                if isinstance(row, dict) and _BATCH_ROW_KEYS <= row.keys()
+            }
+        except asyncio.CancelledError:
+            for _, future in batch:
+                future.cancel()
+            raise
+        except Exception:
+            by_id = {}
+
+        for idx, (_, future) in enumerate(batch):
+            if not future.done():
+                future.set_result(by_id.get(idx))
+
+
+extraction_batcher = ExtractionBatcher(max_batch=8, max_wait_ms=10)
 
 
 async def extract_key_info(scraped_data_json: str) -> str:
@@ -135,64 +466,56 @@ async def extract_key_info(scraped_data_json: str) -> str:
         JSON string containing extracted key information
     """
     try:
-        scraped_data = json.loads(scraped_data_json)
+        scraped_data = orjson.loads(scraped_data_json)
         if 'scraped_data' not in scraped_data:
-            return json.dumps({'status': 'error', 'message': 'Invalid scraped data format'})
+            return _dumps({'status': 'error', 'message': 'Invalid scraped data format'})
         
-        extracted_items = []
-
-        # Lazy import of generative model to avoid heavy import at module load
-        from google.genai import GenerativeModel
-
-        model = GenerativeModel("gemini-2.5-pro-preview-06-05")
-
-        for item in scraped_data['scraped_data']:
-            if item['status'] != 'success' or not item['content']:
-                continue
-
-            markdown_snippet = item['content']
-
-            prompt = (
-                """You are extracting structured e-commerce data from raw markdown of a product web page.\n"
-                "Return ONLY valid minified JSON with exactly these keys: \n"
-                "  name (string) – product/service name,\n"
-                "  price (string) – price with currency symbol if present, or \"Price not found\" if absent,\n"
-                "  description (string) – concise 1-2 sentence description (max 120 chars).\n"
-                "Do NOT wrap the JSON in markdown fences or add extra text.\n\n"
-                f"Markdown:\n{markdown_snippet}"""
-            )
-
-            try:
-                gen_resp = await model.generate_content_async(prompt)
-                print(gen_resp.text)
-                # The model sometimes adds markdown fences or text – try to locate JSON substring
-                raw_out = gen_resp.text.strip()
-                json_start = raw_out.find('{')
-                json_end = raw_out.rfind('}') + 1
-                structured = json.loads(raw_out[json_start:json_end])
-            except Exception:
+        items = [
+            item for item in scraped_data['scraped_data']
+            if item['status'] == 'success' and item['content']
+        ]
+
+        key = _cache_key(
+            "extract_key_info",
+            items=[{'url': item['url'], 'title': item.get('title', ''), 'content': item['content']} for item in items],
+        )
+        cached = _extract_cache.get(key)
+        if cached is not None:
+            return cached
+
+        async def _extract(item: Dict[str, Any]) -> Tuple[Dict[str, Any], bool]:
+            """Returns the extracted entry and whether it came from a model answer."""
+            markdown_snippet = _clip(item['content'])
+            structured = await extraction_batcher.submit(markdown_snippet)
+            if structured is None:
+                # Batch answer unusable for this page – fall back to a dedicated call
+                structured = await _extract_single(markdown_snippet)
+            from_model = structured is not None
+            if not from_model:
                 # Fallback to naive extraction using title
                 structured = {
                     "name": item.get("title", "N/A"),
                     "price": "Price not found",
                     "description": markdown_snippet[:120],
                 }
+            return {"link": item["url"], **structured}, from_model
 
-            extracted_items.append({
-                "link": item["url"],
-                **structured,
-            })
+        # Pages are batched together with those of any concurrent request
+        results = await asyncio.gather(*[_extract(item) for item in items])
+        extracted_items = [entry for entry, _ in results]
         
-        return json.dumps({'status': 'success', 'extracted_items': extracted_items})
+        response = _dumps({'status': 'success', 'extracted_items': extracted_items})
+        # Naive fallbacks come from transient model failures; don't pin them in the cache
+        if all(from_model for _, from_model in results):
+            _extract_cache[key] = response
+        return response
     except Exception as e:
-        return json.dumps({'status': 'error', 'message': str(e)})
+        return _dumps({'status': 'error', 'message': str(e)})
 
 
 # Create function tools
 search_web_tool = FunctionTool(func=search_web)
 search_image_tool = FunctionTool(func=search_by_image)
-scrape_websites_tool = FunctionTool(func=scrape_websites)
-extract_info_tool = FunctionTool(func=extract_key_info)
 
 
 # Step 1: Search Agent - Finds data on the internet
@@ -206,31 +529,8 @@ search_agent = LlmAgent(
     output_key="search_results"
 )
 
-# Step 2: Scraping Agent - Scrapes websites from found links
-scraping_agent = LlmAgent(
-    name="ScrapingAgent", 
-    model="gemini-2.5-pro-preview-06-05",
-    description="Agent that scrapes websites and converts them to markdown",
-    instruction="""You are a web scraping specialist. Take the search results from the previous step and use the scrape_websites tool 
-    to get the markdown content of each website. Focus on the most relevant links.""",
-    tools=[scrape_websites_tool],
-    output_key="scraped_content"
-)
-
-# Step 3: Extraction Agent - Extracts key information using LLM
-extraction_agent = LlmAgent(
-    name="ExtractionAgent",
-    model="gemini-2.5-pro-preview-06-05", 
-    description="Agent that extracts key information from scraped content",
-    instruction="""You are a data extraction specialist. Take the scraped content and use the extract_info_tool to find:
-    - Product/item names
-    - Prices (if available)
-    - Direct links
-    - Brief descriptions
-    Return structured data that's easy to understand.""",
-    tools=[extract_info_tool],
-    output_key="extracted_data"
-)
+# Steps 2 and 3 (scraping and extraction) run inside SearchPipelineAgent as
+# plain coroutines fed by queues, see below.
 
 # Step 4: Response Agent - Formats the final response
 response_agent = LlmAgent(
@@ -246,11 +546,109 @@ response_agent = LlmAgent(
     output_key="final_response"
 )
 
-# Multi-step Search and Processing Agent (Sequential workflow)
-search_processing_agent = SequentialAgent(
+
+def _links_from_event(event: Event) -> List[Dict[str, Any]]:
+    """Returns the links carried by search tool responses in `event`, if any."""
+    links = []
+    for function_response in event.get_function_responses():
+        if function_response.name not in ('search_web', 'search_by_image'):
+            continue
+        # FunctionTool wraps non-dict return values as {"result": value}
+        payload = function_response.response or {}
+        payload = payload.get('result', payload)
+        if isinstance(payload, str):
+            try:
+                payload = orjson.loads(payload)
+            except orjson.JSONDecodeError:
+                continue
+        if isinstance(payload, dict):
+            links.extend(link for link in payload.get('links', []) if 'link' in link)
+    return links
+
+
+class SearchPipelineAgent(BaseAgent):
+    """
+    Search -> scrape -> extract -> respond, pipelined instead of strictly sequential.
+
+    Links are pushed to a queue as soon as a search tool returns them, while the
+    search agent is still running. The scrape stage consumes that queue and feeds
+    scraped pages into a second queue, which an extractor task consumes page by page. Once all stages are done, the extracted items are stored in session
+    state and the response agent formats the final answer.
+    """
+
+    search_agent: LlmAgent
+    response_agent: LlmAgent
+
+    model_config = {"arbitrary_types_allowed": True}
+
+    def __init__(self, name: str, description: str, search_agent: LlmAgent, response_agent: LlmAgent):
+        super().__init__(
+            name=name,
+            description=description,
+            search_agent=search_agent,
+            response_agent=response_agent,
+            sub_agents=[search_agent, response_agent],
+        )
+
+    async def _run_async_impl(self, ctx: InvocationContext) -> AsyncGenerator[Event, None]:
+        link_queue: asyncio.Queue = asyncio.Queue()
+        page_queue: asyncio.Queue = asyncio.Queue()
+        # Position of each queued link, so items finishing out of order are emitted in link order
+        link_positions: Dict[str, int] = {}
+        extracted_by_position: Dict[int, List[Dict[str, Any]]] = {}
+
+        async def _extractor() -> None:
+            async def _extract(page: Dict[str, Any]) -> None:
+                result = orjson.loads(await extract_key_info(_dumps({'scraped_data': [page]})))
+                extracted_by_position[link_positions[page['url']]] = result.get('extracted_items', [])
+
+            # Scoped to a task group so cancelling the stage also cancels pending extractions
+            async with asyncio.TaskGroup() as tg:
+                while (page := await page_queue.get()) is not None:
+                    if page['status'] == 'success' and page['content']:
+                        tg.create_task(_extract(page))
+
+        stages = asyncio.gather(_scrape_stage(link_queue, page_queue), _extractor())
+        try:
+            async for event in self.search_agent.run_async(ctx):
+                for link_info in _links_from_event(event):
+                    if len(link_positions) < MAX_SCRAPE_LINKS and link_info['link'] not in link_positions:
+                        link_positions[link_info['link']] = len(link_positions)
+                        await link_queue.put(link_info)
+                yield event
+        except BaseException:
+            stages.cancel()
+            raise
+
+        # Search is finished: let the scraper drain and wait for the remaining stages
+        await link_queue.put(None)
+        scraped_pages, _ = await stages
+
+        extracted_items = [
+            item for position in sorted(extracted_by_position) for item in extracted_by_position[position]
+        ]
+        extracted_data = _dumps({'status': 'success', 'extracted_items': extracted_items})
+        yield Event(
+            author=self.name,
+            invocation_id=ctx.invocation_id,
+            branch=ctx.branch,
+            content=types.Content(role="model", parts=[types.Part(text=extracted_data)]),
+            actions=EventActions(state_delta={
+                'scraped_content': _dumps({'status': 'success', 'scraped_data': scraped_pages}),
+                'extracted_data': extracted_data,
+            }),
+        )
+
+        async for event in self.response_agent.run_async(ctx):
+            yield event
+
+
+# Multi-step Search and Processing Agent (pipelined workflow)
+search_processing_agent = SearchPipelineAgent(
     name="SearchProcessingAgent",
     description="Multi-step agent that searches, scrapes, extracts, and formats information from the web",
-    sub_agents=[search_agent, scraping_agent, extraction_agent, response_agent]
+    search_agent=search_agent,
+    response_agent=response_agent,
 )
 
 # Simple General Query Agent
@@ -264,6 +662,9 @@ general_query_agent = LlmAgent(
     output_key="general_response"
 )
 
+WARDROBE_FIELDS = ('id', 'name', 'image_url', 'category', 'features')
+
+
 async def get_user_wardrobe(tool_context: ToolContext) -> str:
     """
     Retrieves all clothing items from the authenticated user's wardrobe.
@@ -272,26 +673,29 @@ async def get_user_wardrobe(tool_context: ToolContext) -> str:
     try:
         user_id = tool_context.session.state.get("user_id")
         if not user_id:
-            return json.dumps({'status': 'error', 'message': 'User not authenticated or user_id not in session state.'})
+            return _dumps({'status': 'error', 'message': 'User not authenticated or user_id not in session state.'})
 
-        db = SessionLocal()
-        items = db.query(ClothingItem).filter(ClothingItem.user_id == user_id).all()
-        
-        wardrobe = []
-        for item in items:
-            wardrobe.append({
-                'id': item.id,
-                'name': item.name,
-                'image_url': item.image_url,
-                'category': item.category,
-                'features': item.features
-            })
+        # Select only the needed columns: rows come back as tuples, skipping ORM hydration
+        stmt = select(
+            ClothingItem.id,
+            ClothingItem.name,
+            ClothingItem.image_url,
+            ClothingItem.category,
+            ClothingItem.features,
+        ).where(ClothingItem.user_id == user_id)
+
+        if AsyncSessionLocal is None:
+            return _dumps({'status': 'error', 'message': 'Async database access is not configured.'})
+
+        # Async session so the query doesn't block other coroutines on the event loop
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(stmt)).all()
+
+        wardrobe = [dict(zip(WARDROBE_FIELDS, row)) for row in rows]
         
-        return json.dumps({'status': 'success', 'wardrobe': wardrobe})
+        return _dumps({'status': 'success', 'wardrobe': wardrobe})
     except Exception as e:
-        return json.dumps({'status': 'error', 'message': str(e)})
-    finally:
-        db.close()
+        return _dumps({'status': 'error', 'message': str(e)})
 
 # Create function tool for wardrobe access
 get_wardrobe_tool = FunctionTool(func=get_user_wardrobe)
@@ -337,50 +741,99 @@ coordinator_agent = LlmAgent(
 root_agent = coordinator_agent
 
 
-async def process_user_request(message: str, user_id: int) -> str:
-    """
-    Process user request through the multi-agent system.
-    
-    Args:
-        message: User's message/request
-        user_id: The ID of the authenticated user.
-        
-    Returns:
-        Response from the appropriate agent
-    """
-    try:
+APP_NAME = "ClosetMind"
+
+# Whether this ADK version's events can tell us they are the final response;
+# checked once here instead of on every streamed event.
+_HAS_FINAL_RESPONSE_FLAG = callable(getattr(Event, "is_final_response", None))
+
+# Shared across requests so that sessions (and conversation state) survive
+# between calls; created lazily on first use.
+_session_service = None
+_runner = None
+
+# Per-user sessions are dropped once idle for SESSION_TTL_SECONDS, or
+# least-recently-used first when more than MAX_SESSIONS are held in memory.
+SESSION_TTL_SECONDS = 60 * 60
+MAX_SESSIONS = 10_000
+_session_last_used: "OrderedDict[str, float]" = OrderedDict()
+# Serializes get-or-create so concurrent first requests of a user don't both create the session
+_session_lock = asyncio.Lock()
+
+
+def _get_runner():
+    """Returns the shared ADK runner, creating it and its session service on first use."""
+    global _session_service, _runner
+    if _runner is None:
         # Instead of manually creating an InvocationContext (which requires many
         # internal services), we'll leverage the ADK `Runner` which handles all
         # low-level details for us (session service, invocation IDs, context
         # creation, etc.).
-
-        from google.adk.sessions import InMemorySessionService, Session
+        from google.adk.sessions import InMemorySessionService
         from google.adk.runners import Runner
-        from google.genai import types
 
-        # Simple in-memory session service for this example.
-        session_service = InMemorySessionService()
+        _session_service = InMemorySessionService()
+        _runner = Runner(agent=root_agent, session_service=_session_service, app_name=APP_NAME)
+    return _runner
 
-        # Ensure a session exists and has the user_id in its state
+
+async def _ensure_session(user_id: int) -> str:
+    """
+    Returns the id of the user's session, creating it if needed and evicting idle sessions.
+
+    Sessions are keyed per user so concurrent users don't share state.
+    """
+    session_id = f"user_{user_id}"
+    async with _session_lock:
         try:
-            session = await session_service.get_session(
-                app_name="ClosetMind",
+            session = await _session_service.get_session(
+                app_name=APP_NAME,
                 user_id="user_closetmind",
-                session_id="session_closetmind",
+                session_id=session_id,
             )
-            session.state["user_id"] = user_id
-            await session_service.update_session(session)
         except Exception:
+            session = None
+        if session is None:
             # Session does not exist, create it.
-            await session_service.create_session(
-                app_name="ClosetMind",
+            await _session_service.create_session(
+                app_name=APP_NAME,
                 user_id="user_closetmind",
-                session_id="session_closetmind",
+                session_id=session_id,
                 state={"user_id": user_id},
             )
 
-        # Initialize the runner with our root agent and session service.
-        runner = Runner(agent=root_agent, session_service=session_service, app_name="ClosetMind")
+        now = time.monotonic()
+        _session_last_used[session_id] = now
+        _session_last_used.move_to_end(session_id)
+
+        # Oldest entries come first, so stop at the first one that may stay
+        while _session_last_used:
+            oldest_id, last_used = next(iter(_session_last_used.items()))
+            if now - last_used < SESSION_TTL_SECONDS and len(_session_last_used) <= MAX_SESSIONS:
+                break
+            del _session_last_used[oldest_id]
+            await _session_service.delete_session(
+                app_name=APP_NAME,
+                user_id="user_closetmind",
+                session_id=oldest_id,
+            )
+    return session_id
+
+
+async def process_user_request(message: str, user_id: int) -> str:
+    """
+    Process user request through the multi-agent system.
+    
+    Args:
+        message: User's message/request
+        user_id: The ID of the authenticated user.
+        
+    Returns:
+        Response from the appropriate agent
+    """
+    try:
+        runner = _get_runner()
+        session_id = await _ensure_session(user_id)
 
         # Wrap the raw user text in a `Content` object expected by the runner.
         user_content = types.Content(role="user", parts=[types.Part(text=message)])
@@ -390,24 +843,23 @@ async def process_user_request(message: str, user_id: int) -> str:
         # Stream events; keep updating `final_answer` when we hit a final response.
         async for event in runner.run_async(
             user_id="user_closetmind",
-            session_id="session_closetmind",
+            session_id=session_id,
             new_message=user_content,
         ):
-            if not (event.content and getattr(event.content, "parts", None)):
+            content = event.content
+            parts = content.parts if content else None
+            if not parts:
                 continue
 
             # Extract first textual part (many events include only one part)
-            text_part = event.content.parts[0]
-            if not (hasattr(text_part, "text") and text_part.text):
+            text = getattr(parts[0], "text", None)
+            if not text:
                 continue
 
-            # If the event signals it is the final response from the agent tree, store it
-            if hasattr(event, "is_final_response") and callable(event.is_final_response):
-                if event.is_final_response():
-                    final_answer = text_part.text
-            else:
-                # Fallback: if no explicit flag, just keep updating; the last message will be our answer
-                final_answer = text_part.text
+            # Store it if the event is the final response from the agent tree; without
+            # an explicit flag, just keep updating so the last message is our answer
+            if not _HAS_FINAL_RESPONSE_FLAG or event.is_final_response():
+                final_answer = text
 
         if final_answer:
             return final_answer
@@ -1,7 +1,9 @@
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
+from typing import Optional
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -31,6 +33,37 @@ engine = create_engine(
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+def _to_async_url(url: str) -> Optional[str]:
+    """Switches a PostgreSQL URL to the asyncio-capable psycopg 3 driver; None for other databases."""
+    scheme, _, rest = url.partition("://")
+    if scheme.split("+", 1)[0] == "postgresql":
+        return f"postgresql+psycopg://{rest}"
+    return None
+
+# Async engine for coroutines that must not block the event loop (e.g. agent tools).
+# Only light queries go through it, so its pool is kept small to stay well below
+# the Postgres connection limit next to the main pool. Without an async driver for
+# the configured database it stays None instead of failing the whole app at import.
+ASYNC_DATABASE_URL = _to_async_url(SQLALCHEMY_DATABASE_URL)
+
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    pool_size=5,
+    max_overflow=5,
+    pool_timeout=60,
+    pool_recycle=3600,
+    pool_pre_ping=True,
+    echo=False,
+    connect_args={
+        "connect_timeout": 10,
+    }
+) if ASYNC_DATABASE_URL else None
+
+AsyncSessionLocal = (
+    async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+    if async_engine is not None else None
+)
+
 Base = declarative_base()
 
 def get_db():
@@ -1,13 +1,16 @@
 from dotenv import load_dotenv
 load_dotenv()
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from fastapi.staticfiles import StaticFiles
 from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.responses import JSONResponse
 from src.database import engine, Base
 from src.routers import auth, agent_router, wardrobe, waitlist, chat, tryon, stores, products, reviews, admin
 import os
+import sys
 
 # NOTE: Таблицы теперь создаются через миграции Alembic
 # Используйте: alembic upgrade head для применения миграций
@@ -31,8 +34,22 @@ class LimitUploadSize(BaseHTTPMiddleware):
                     )
         return await call_next(request)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # Закрываем общий браузер скрапера, если он был запущен
+    from src.utils.scrap_website import close_crawler
+    await close_crawler()
+    # Останавливаем воркер пакетного извлечения, если модуль агентов был загружен
+    agents_module = sys.modules.get("copys.agents_with_adk")
+    if agents_module is not None:
+        await agents_module.extraction_batcher.aclose()
+
 app = FastAPI(
     title="ClosetMind API",
+    lifespan=lifespan,
+    # Сериализуем все ответы через orjson вместо стандартного json
+    default_response_class=ORJSONResponse,
     # Увеличиваем лимит размера запроса до 10MB
     max_upload_size=50 * 1024 * 1024  # 10MB в байтах
 )
@@ -1,14 +1,17 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Body
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from datetime import timedelta
 from src.database import get_db
 from src.models.user import User
 from src.schemas.user import UserCreate, UserResponse, Token
 from src.utils.auth import (
-    verify_password,
+    verify_password_async,
     get_password_hash,
     create_access_token,
+    get_user_by_email,
     ACCESS_TOKEN_EXPIRE_MINUTES
 )
 from src.utils.email import (
@@ -20,6 +23,8 @@ from src.utils.email import (
 )
 from pydantic import BaseModel, EmailStr
 import os
+import requests
+from cachetools import TTLCache
 from google.oauth2 import id_token
 from google.auth.transport.requests import Request as GoogleRequest
 
@@ -33,10 +38,35 @@ class EmailSchema(BaseModel):
 
 GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID")
 
+class CachingGoogleRequest(GoogleRequest):
+    """
+    google-auth transport that reuses one HTTP session and keeps successful
+    GET responses (Google's public signing certs) in memory for `ttl` seconds,
+    so token verification doesn't re-fetch the certs on every login.
+    """
+
+    def __init__(self, ttl: int = 3600):
+        super().__init__(session=requests.Session())
+        self._cache = TTLCache(maxsize=8, ttl=ttl)
+
+    def __call__(self, url, method="GET", body=None, headers=None, **kwargs):
+        # `timeout` is left in kwargs so google-auth's own default applies when callers omit it
+        if method != "GET" or body is not None:
+            return super().__call__(url, method=method, body=body, headers=headers, **kwargs)
+
+        response = self._cache.get(url)
+        if response is None:
+            response = super().__call__(url, method=method, headers=headers, **kwargs)
+            if response.status == 200:
+                self._cache[url] = response
+        return response
+
+_google_request = CachingGoogleRequest()
+
 @router.post("/send-verification-code")
 def send_code(payload: EmailSchema, db: Session = Depends(get_db)):
     # Проверяем, существует ли пользователь
-    db_user = db.query(User).filter(User.email == payload.email).first()
+    db_user = get_user_by_email(db, payload.email)
     if db_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -54,14 +84,13 @@ def send_code(payload: EmailSchema, db: Session = Depends(get_db)):
 
 @router.post("/register", response_model=UserResponse)
 def register(user: UserCreate, db: Session = Depends(get_db)):
-    # Проверяем, существует ли пользователь
-    db_user = db.query(User).filter(User.email == user.email).first()
-    if db_user:
+    # Проверяем, существует ли пользователь, до дорогого хеширования пароля
+    if get_user_by_email(db, user.email):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Email already registered"
         )
-    
+
     # Проверяем код верификации
     stored_code = get_verification_code(user.email)
     if not stored_code or stored_code != user.verification_code:
@@ -70,16 +99,38 @@ def register(user: UserCreate, db: Session = Depends(get_db)):
             detail="Invalid verification code"
         )
 
-    # Создаем нового пользователя
+    # Создаем нового пользователя одним INSERT ... ON CONFLICT, чтобы
+    # параллельная регистрация с тем же email не проскочила между проверкой и вставкой
     hashed_password = get_password_hash(user.password)
-    db_user = User(
-        email=user.email,
-        username=user.username,
-        hashed_password=hashed_password
+    stmt = (
+        pg_insert(User)
+        .values(
+            email=user.email,
+            username=user.username,
+            hashed_password=hashed_password
+        )
+        .on_conflict_do_nothing(index_elements=[User.email])
+        .returning(User)
     )
-    db.add(db_user)
+    try:
+        db_user = db.scalars(stmt).one_or_none()
+    except IntegrityError:
+        # ON CONFLICT покрывает только email; занятый username нарушает свой уникальный индекс
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Username already taken"
+        )
+    if db_user is None:
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Email already registered"
+        )
+    # RETURNING уже загрузил все поля; отсоединяем объект, чтобы commit
+    # не сбросил их и сериализация ответа не делала лишний SELECT
+    db.expunge(db_user)
     db.commit()
-    db.refresh(db_user)
     
     # Удаляем код после успешной регистрации
     delete_verification_code(user.email)
@@ -91,8 +142,8 @@ async def login(
     form_data: OAuth2PasswordRequestForm = Depends(),
     db: Session = Depends(get_db)
 ):
-    user = db.query(User).filter(User.email == form_data.username).first()
-    if not user or not verify_password(form_data.password, user.hashed_password):
+    user = get_user_by_email(db, form_data.username)
+    if not user or not await verify_password_async(form_data.password, user.hashed_password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
@@ -110,12 +161,12 @@ async def google_login(payload: GoogleLoginRequest = Body(...), db: Session = De
     try:
         idinfo = id_token.verify_oauth2_token(
             payload.id_token,
-            GoogleRequest(),
+            _google_request,
             audience=GOOGLE_CLIENT_ID
         )
         email = idinfo["email"]
         username = email.split("@")[0]
-        user = db.query(User).filter(User.email == email).first()
+        user = get_user_by_email(db, email)
         if not user:
             user = User(username=username, email=email, hashed_password="google-oauth")
             db.add(user)
@@ -1,9 +1,11 @@
+import asyncio
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy import select, bindparam
 from sqlalchemy.orm import Session
 from src.database import get_db
 from src.models.user import User
@@ -17,12 +19,24 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 1000000
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+# Запрос пользователя по email строится один раз: горячий путь авторизации
+# не пересобирает statement, а скомпилированная форма берется из кэша
+_find_user_by_email = select(User).where(User.email == bindparam("email"))
+
+def get_user_by_email(db: Session, email: str) -> Optional[User]:
+    return db.scalars(_find_user_by_email, {"email": email}).first()
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """Runs the CPU-bound bcrypt check in the default thread pool so it doesn't block the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, verify_password, plain_password, hashed_password)
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     to_encode = data.copy()
     if expires_delta:
@@ -48,7 +62,7 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
     except JWTError:
         raise credentials_exception
     
-    user = db.query(User).filter(User.email == token_data.email).first()
+    user = get_user_by_email(db, token_data.email)
     if user is None:
         raise credentials_exception
     return user 
\ No newline at end of file
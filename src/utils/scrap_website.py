@@ -1,17 +1,102 @@
 import asyncio
+from typing import Dict, Optional, Set
 from crawl4ai import AsyncWebCrawler
 
-async def scrap_website(url: str):
+# Shared crawler so concurrent scrapes reuse one browser instead of launching
+# a new one per URL; started lazily on first use.
+_crawler: Optional[AsyncWebCrawler] = None
+_crawler_lock = asyncio.Lock()
+# Scrapes currently running on each crawler, and crawlers no longer handed out
+# that are waiting for those scrapes to finish before being closed
+_active_scrapes: Dict[AsyncWebCrawler, int] = {}
+_retired: Set[AsyncWebCrawler] = set()
+
+
+def _browser_alive(crawler: AsyncWebCrawler) -> bool:
+    """Whether the Playwright browser behind `crawler` is still connected."""
+    strategy = getattr(crawler, "crawler_strategy", None)
+    browser = getattr(getattr(strategy, "browser_manager", None), "browser", None)
+    if browser is None:
+        # No browser handle to inspect (e.g. persistent context); assume it is alive
+        return True
+    return browser.is_connected()
+
+
+async def get_crawler() -> AsyncWebCrawler:
+    """
+    Returns the shared AsyncWebCrawler, starting it on first use.
+
+    Returns:
+        A started AsyncWebCrawler instance shared across scrapes
+    """
+    global _crawler
+    async with _crawler_lock:
+        if _crawler is not None and not _browser_alive(_crawler):
+            stale = _crawler
+            _retire_crawler(stale)
+            await _close_if_idle(stale)
+        if _crawler is None:
+            crawler = AsyncWebCrawler()
+            await crawler.start()
+            _crawler = crawler
+    return _crawler
+
+
+def _retire_crawler(crawler: AsyncWebCrawler) -> None:
+    """Stops handing out `crawler`, so the next `get_crawler` starts a fresh browser."""
+    global _crawler
+    if _crawler is crawler:
+        _crawler = None
+    _retired.add(crawler)
+
+
+async def _close_if_idle(crawler: AsyncWebCrawler) -> None:
+    """Closes a retired crawler once no scrape is running on it."""
+    if crawler not in _retired or _active_scrapes.get(crawler):
+        return
+    _retired.discard(crawler)
+    try:
+        await crawler.close()
+    except Exception as e:
+        print(f"Error closing crawler: {e}")
+
+
+async def close_crawler() -> None:
+    """Closes the shared crawler and any retired ones (call on application shutdown)."""
+    if _crawler is not None:
+        _retire_crawler(_crawler)
+    for crawler in list(_retired):
+        _active_scrapes.pop(crawler, None)
+        await _close_if_idle(crawler)
+
+
+async def scrap_website(url: str, crawler: Optional[AsyncWebCrawler] = None):
     """
     Scrapes a website and returns the result object with markdown content.
-    
+
     Args:
         url: The URL to scrape
-        
+        crawler: Optional already started crawler to reuse (see `get_crawler`).
+            If omitted, a short-lived crawler is created for this call.
+
     Returns:
         Result object from the crawler with markdown content
     """
     try:
+        if crawler is not None:
+            _active_scrapes[crawler] = _active_scrapes.get(crawler, 0) + 1
+            try:
+                return await crawler.arun(url=url)
+            finally:
+                remaining = _active_scrapes.pop(crawler, 1) - 1
+                if remaining:
+                    _active_scrapes[crawler] = remaining
+                # A page or context error leaves the browser connected; only a
+                # disconnected browser is replaced
+                if not _browser_alive(crawler):
+                    _retire_crawler(crawler)
+                await _close_if_idle(crawler)
+
         # Create an instance of AsyncWebCrawler
         async with AsyncWebCrawler() as crawler:
             # Run the crawler on a URL
@@ -19,4 +104,4 @@ async def scrap_website(url: str):
             return result
     except Exception as e:
         print(f"Error scraping {url}: {e}")
-        return None
\ No newline at end of file
+        return None